@@ -1,13 +1,28 @@
+from __future__ import annotations
+
+import functools
+import hashlib
 import json
 import os
 import re
+import time
 import logging
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
-from zoneinfo import ZoneInfo
+from html import unescape
+from typing import TYPE_CHECKING, List, Dict, Optional, Sequence, Set, Tuple
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+# requests and zoneinfo are imported where used so importing this module stays cheap
+if TYPE_CHECKING:
+    from zoneinfo import ZoneInfo
 
-import requests
-from bs4 import BeautifulSoup
+    import requests
 
 # -------------------------------------------------
 # Logging
@@ -18,8 +33,8 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 # Environment
 # -------------------------------------------------
 WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
-if not WEBHOOK_URL:
-    raise EnvironmentError("DISCORD_WEBHOOK_URL not set")
+# Seconds between checks when run as a long-lived process; 0 means run once and exit (cron)
+POLL_INTERVAL = os.getenv("POLL_INTERVAL", "0")
 
 # -------------------------------------------------
 # Constants
@@ -28,94 +43,242 @@ FIXTURES_URL = "https://www.edcapitals.com/25-26-snl-fixtures/"
 HOME_URL = "https://www.edcapitals.com/"
 STATE_FILE = "posted.json"
 
-UK_TZ = ZoneInfo("Europe/London")
-
 # -------------------------------------------------
 # Regex
 # -------------------------------------------------
 SCORE_PATTERN = re.compile(r"\b(\d{1,2})\s*[-–]\s*(\d{1,2})\b")
 FIXTURE_DT_PATTERN = re.compile(r"\b(\d{1,2}\s+[A-Za-z]{3}\s+\d{4}\s+\d{2}:\d{2})\b")
+WS_RE = re.compile(r"\s+")
+LINE_BREAK_RE = re.compile(r"\s*\n\s*")
+INLINE_WS_RE = re.compile(r"[^\S\n]+")
+NEWLINE_RE = re.compile(r"\n")
+# Markup to drop when extracting page text: bodies of non-visible elements, comments, tags
+# (self-closing tags such as <svg .../> have no body and fall through to the plain-tag branch)
+TAG_RE = re.compile(
+    r"(?is)<(script|style|svg|head)\b[^>]*(?<!/)>.*?</\1\s*>|<!--.*?-->|<[^>]+>"
+)
 
 KNOWN_TEAMS = [
     "Capitals", "Warriors", "Rockets", "Pirates", "Tigers",
     "Kestrels", "Wild", "Thunder", "Lynx", "Sharks", "Stars",
 ]
+# Matched against lowercased text, which is cheaper than re.IGNORECASE case-folding
+TEAMS_ALT = re.compile(r"\b(" + "|".join(re.escape(t.lower()) for t in KNOWN_TEAMS) + r")\b")
+TEAM_CANONICAL = {t.lower(): t for t in KNOWN_TEAMS}
+OPPONENTS = [t for t in KNOWN_TEAMS if t != "Capitals"]
+
+MONTHS = {
+    m: i for i, m in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1
+    )
+}
 
 # -------------------------------------------------
 # Utilities
 # -------------------------------------------------
 def norm(s: str) -> str:
-    return re.sub(r"\s+", " ", s).strip()
+    return WS_RE.sub(" ", s).strip()
+
+
+@functools.lru_cache(maxsize=8)
+def page_text(html: str) -> str:
+    """Visible page text: one normalised, non-empty line per "\n"-separated line.
+
+    >>> page_text('<div><svg class="i"/></div><p>Capitals 3 - 2 Warriors</p><svg><path/></svg>')
+    'Capitals 3 - 2 Warriors'
+    """
+    text = unescape(TAG_RE.sub("\n", html))
+    return INLINE_WS_RE.sub(" ", LINE_BREAK_RE.sub("\n", text)).strip()
+
+
+def line_starts(text: str) -> List[int]:
+    """Offset of every line in text, plus a sentinel one past the end."""
+    return [0] + [m.end() for m in NEWLINE_RE.finditer(text)] + [len(text) + 1]
+
+
+def capitals_lines(text: str, starts: List[int]) -> List[int]:
+    hits = []
+    pos = text.find("Capitals")
+    while pos != -1:
+        li = bisect_right(starts, pos) - 1
+        hits.append(li)
+        pos = text.find("Capitals", starts[li + 1])
+    return hits
+
+
+@functools.cache
+def uk_tz() -> ZoneInfo:
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo("Europe/London")
+
+
+@functools.cache
+def http_session() -> requests.Session:
+    """One keep-alive session for every request, so repeat calls skip the TLS handshake."""
+    import requests
+
+    return requests.Session()
 
 
 def post_to_discord(content: str) -> None:
-    r = requests.post(WEBHOOK_URL, json={"content": content}, timeout=20)
+    r = http_session().post(WEBHOOK_URL, json={"content": content}, timeout=20)
     r.raise_for_status()
 
 
 def load_state() -> Dict:
+    """Load state with the posted-id lists as insertion-ordered dicts.
+
+    Dict keys give O(1) membership checks like a set, but keep a stable order,
+    so new ids are appended on save instead of re-sorting the whole history.
+    """
     if not os.path.exists(STATE_FILE):
-        return {"results": [], "pregame": []}
+        return {"results": {}, "pregame": {}, "etags": {}}
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            state = json.load(f)
+        with open(STATE_FILE, "rb") as f:
+            raw = f.read()
+        state = orjson.loads(raw) if orjson else json.loads(raw)
     except Exception:
-        return {"results": [], "pregame": []}
+        return {"results": {}, "pregame": {}, "etags": {}}
 
-    state.setdefault("results", [])
-    state.setdefault("pregame", [])
+    state["results"] = dict.fromkeys(state.get("results", []))
+    state["pregame"] = dict.fromkeys(state.get("pregame", []))
+    state.setdefault("etags", {})
     return state
 
 
 def save_state(state: Dict) -> None:
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2)
+    out = dict(state, results=list(state["results"]), pregame=list(state["pregame"]))
+    if orjson:
+        data = orjson.dumps(out, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(out, indent=2, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    try:
+        with open(STATE_FILE, "rb") as f:
+            if f.read() == data:
+                return
+    except OSError:
+        pass
+    with open(STATE_FILE, "wb") as f:
+        f.write(data)
+
+
+def conditional_get(url: str, state: Dict) -> Optional[requests.Response]:
+    """GET url, returning None if it is unchanged since the last processed fetch
+    or the server did not return the page (only 200 responses are processed)."""
+    cached = state["etags"].get(url, {})
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    r = http_session().get(url, headers=headers, timeout=20)
+    if r.status_code == 304:
+        return None
+    if r.status_code != 200:
+        # Error pages must not be parsed or have their validators remembered
+        logging.warning("GET %s returned HTTP %s; skipping", url, r.status_code)
+        return None
+    # Servers that ignore validators still get caught by the body hash
+    if cached.get("body_sha") and cached["body_sha"] == body_sha(r.content):
+        return None
+    return r
+
+
+def remember_validators(state: Dict, url: str, r: requests.Response) -> bool:
+    """Store the response validators for url; returns True if they changed."""
+    validators = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "body_sha": body_sha(r.content),
+    }
+    if state["etags"].get(url) == validators:
+        return False
+    state["etags"][url] = validators
+    return True
+
+
+def body_sha(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+def teams_by_line(text: str, starts: List[int]) -> List[Set[str]]:
+    """Teams named on each line, from a single TEAMS_ALT pass over the whole page."""
+    found: List[Set[str]] = [set() for _ in starts[1:]]
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # A few non-ASCII characters lowercase to two code points, shifting offsets
+        starts = line_starts(lowered)
+    for m in TEAMS_ALT.finditer(lowered):
+        found[bisect_right(starts, m.start()) - 1].add(TEAM_CANONICAL[m.group(1)])
+    return found
+
+
+def find_opponent(line_teams: Sequence[Set[str]]) -> Optional[str]:
+    """The Capitals' opponent named in a window of lines, or None."""
+    found = set().union(*line_teams)
+    if "Capitals" not in found:
+        return None
+    # KNOWN_TEAMS order keeps the opponent (and the match id built from it) stable
+    return next((t for t in OPPONENTS if t in found), None)
 
 
-def find_teams(text: str) -> List[str]:
-    return [
-        t for t in KNOWN_TEAMS
-        if re.search(rf"\b{re.escape(t)}\b", text, re.IGNORECASE)
-    ]
+@functools.lru_cache(maxsize=256)
+def parse_fixture_dt(raw: str) -> Optional[datetime]:
+    """Parse "%d %b %Y %H:%M" by hand; strptime re-interprets the format on every call."""
+    day, mon, year, hm = raw.split()
+    month = MONTHS.get(mon.lower())
+    if month is None:
+        return None
+    try:
+        return datetime(int(year), month, int(day), int(hm[:2]), int(hm[3:]), tzinfo=uk_tz())
+    except ValueError:
+        return None
 
 
 def parse_datetimes(text: str) -> List[datetime]:
     out = []
     for m in FIXTURE_DT_PATTERN.finditer(text):
-        try:
-            dt = datetime.strptime(m.group(1), "%d %b %Y %H:%M").replace(tzinfo=UK_TZ)
+        dt = parse_fixture_dt(m.group(1))
+        if dt is not None:
             out.append(dt)
-        except ValueError:
-            pass
     return out
 
 # -------------------------------------------------
 # 1) FINAL RESULT POSTING
 # -------------------------------------------------
-def post_final_results() -> None:
+def fetch_fixtures(state: Dict) -> Optional[requests.Response]:
+    import requests
+
     try:
-        html = requests.get(FIXTURES_URL, timeout=20).text
+        return conditional_get(FIXTURES_URL, state)
     except requests.RequestException:
-        return
+        return None
 
-    soup = BeautifulSoup(html, "html.parser")
-    lines = [norm(x) for x in soup.get_text("\n").split("\n") if x.strip()]
 
-    detected = []
-    for i, line in enumerate(lines):
-        if "Capitals" not in line:
-            continue
+def parse_results(html: str) -> List[Dict]:
+    # Pages without the team name (off-season, JS-rendered) need no text extraction at all
+    if "Capitals" not in html:
+        return []
 
-        window = " ".join(lines[max(0, i - 4): min(len(lines), i + 10)])
+    text = page_text(html)
+    starts = line_starts(text)
+    n = len(starts) - 1
+    line_teams = teams_by_line(text, starts)
+
+    detected = []
+    for i in capitals_lines(text, starts):
+        lo, hi = max(0, i - 4), min(n, i + 10)
+        window = text[starts[lo]:starts[hi]]
         score = SCORE_PATTERN.search(window)
         if not score:
             continue
 
-        teams = find_teams(window)
-        if "Capitals" not in teams or len(teams) < 2:
+        opponent = find_opponent(line_teams[lo:hi])
+        if opponent is None:
             continue
 
-        opponent = next(t for t in teams if t != "Capitals")
         s1, s2 = score.group(1), score.group(2)
 
         msg = (
@@ -127,45 +290,62 @@ def post_final_results() -> None:
         match_id = norm(f"{opponent}-{s1}-{s2}-{window[:80]}")
         detected.append({"id": match_id, "msg": msg})
 
-    if not detected:
+    return detected
+
+
+def post_final_results(r: Optional[requests.Response], state: Dict) -> None:
+    if r is None:
         return
 
-    state = load_state()
-    posted = set(state["results"])
+    detected = parse_results(r.text)
+    posted = state["results"]
+    dirty = False
 
     for d in {x["id"]: x for x in detected}.values():
         if d["id"] in posted:
             continue
         post_to_discord(d["msg"])
-        posted.add(d["id"])
+        posted[d["id"]] = None
+        dirty = True
 
-    state["results"] = sorted(posted)
-    save_state(state)
+    # Only remember the page once everything on it has been posted
+    dirty |= remember_validators(state, FIXTURES_URL, r)
+    if dirty:
+        save_state(state)
 
 # -------------------------------------------------
 # 2) DAY-BEFORE GAME ALERT (T-24h)
 # -------------------------------------------------
-def get_next_capitals_game() -> Optional[Tuple[datetime, str]]:
+def fetch_home() -> Optional[str]:
+    import requests
+
     try:
-        html = requests.get(HOME_URL, timeout=20).text
+        return http_session().get(HOME_URL, timeout=20).text
     except requests.RequestException:
         return None
 
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text("\n")
 
-    if "Upcoming Games" in text:
-        text = text.split("Upcoming Games", 1)[1]
+def parse_next_game(html: str) -> Optional[Tuple[datetime, str]]:
+    if "Capitals" not in html:
+        return None
+
+    text = page_text(html)
+
+    pos = text.find("Upcoming Games")
+    if pos != -1:
+        text = text[pos + len("Upcoming Games"):].lstrip(" \n")
+    if "Capitals" not in text:
+        return None
 
-    lines = [norm(x) for x in text.split("\n") if x.strip()]
-    now = datetime.now(UK_TZ)
+    now = datetime.now(uk_tz())
+    starts = line_starts(text)
+    n = len(starts) - 1
+    line_teams = teams_by_line(text, starts)
     candidates = []
 
-    for i, line in enumerate(lines):
-        if "Capitals" not in line:
-            continue
-
-        window = " ".join(lines[max(0, i - 8): min(len(lines), i + 20)])
+    for i in capitals_lines(text, starts):
+        lo, hi = max(0, i - 8), min(n, i + 20)
+        window = text[starts[lo]:starts[hi]]
         if SCORE_PATTERN.search(window):
             continue
 
@@ -173,30 +353,31 @@ def get_next_capitals_game() -> Optional[Tuple[datetime, str]]:
         if not dts:
             continue
 
-        teams = find_teams(window)
-        if "Capitals" not in teams or len(teams) < 2:
+        opponent = find_opponent(line_teams[lo:hi])
+        if opponent is None:
             continue
 
-        opponent = next(t for t in teams if t != "Capitals")
         candidates.append((min(dts), opponent))
 
     return min(candidates, key=lambda x: x[0]) if candidates else None
 
 
-def post_day_before_alert() -> None:
-    nxt = get_next_capitals_game()
+def post_day_before_alert(html: Optional[str], state: Dict) -> None:
+    if html is None:
+        return
+
+    nxt = parse_next_game(html)
     if not nxt:
         return
 
     game_dt, opponent = nxt
-    now = datetime.now(UK_TZ)
+    now = datetime.now(uk_tz())
 
     # Trigger window: between 24h and 23h before face-off
     delta_hours = (game_dt - now).total_seconds() / 3600
     if not (23 <= delta_hours <= 25):
         return
 
-    state = load_state()
     pid = f"{game_dt.isoformat()}|{opponent}"
     if pid in state["pregame"]:
         return
@@ -208,13 +389,60 @@ def post_day_before_alert() -> None:
     )
     post_to_discord(msg)
 
-    state["pregame"].append(pid)
+    state["pregame"][pid] = None
     save_state(state)
 
 # -------------------------------------------------
 # Main
 # -------------------------------------------------
-if __name__ == "__main__":
+def fetch_pages(state: Dict) -> Tuple[Optional[str], Optional[requests.Response]]:
+    """Fetch the home and fixtures pages in parallel; wall time is the slower RTT."""
+    # Build the shared session here: functools.cache does not stop both workers
+    # from creating one if their first calls race
+    http_session()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        home = pool.submit(fetch_home)
+        fixtures = pool.submit(fetch_fixtures, state)
+        return home.result(), fixtures.result()
+
+
+def run_once(state: Dict) -> None:
+    home_html, fixtures = fetch_pages(state)
+    post_day_before_alert(home_html, state)
+    post_final_results(fixtures, state)
+
+
+def poll_interval() -> int:
+    try:
+        interval = int(POLL_INTERVAL)
+    except ValueError:
+        raise EnvironmentError(
+            f"POLL_INTERVAL must be a whole number of seconds, got {POLL_INTERVAL!r}"
+        ) from None
+    if interval < 0:
+        raise EnvironmentError(f"POLL_INTERVAL must not be negative, got {interval}")
+    return interval
+
+
+def main() -> None:
+    if not WEBHOOK_URL:
+        raise EnvironmentError("DISCORD_WEBHOOK_URL not set")
+    interval = poll_interval()
+
     logging.info("Edinburgh Capitals Match Bot running")
-    post_day_before_alert()
-    post_final_results()
+    state = load_state()
+    if not interval:
+        run_once(state)
+        return
+
+    # Imports, caches, validators and the HTTP session all carry over between ticks
+    while True:
+        try:
+            run_once(state)
+        except Exception:
+            logging.exception("Check failed; retrying next tick")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()